@@ -0,0 +1,353 @@
+"""
+fire_core.py — общий слой данных дашборда FIRE
+===============================================
+Загрузка из PostgreSQL, агрегаты, стили таблицы, промпт-контекст и клиент
+Gemini. app.py импортирует отсюда и отвечает только за раскладку Streamlit.
+"""
+
+import os
+import json
+import re
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit as st
+import pandas as pd
+import numpy as np
+import pyarrow as pa
+import altair as alt
+from sqlalchemy import create_engine
+from sqlalchemy.engine import URL
+from google import genai
+from dotenv import load_dotenv
+
+load_dotenv()
+
+DB_HOST = os.getenv("DB_HOST", "localhost")
+DB_PORT = os.getenv("DB_PORT", "5433")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASS = os.getenv("DB_PASS", "1234")
+DB_NAME = os.getenv("DB_NAME", "fire_db")
+
+COL_SEG     = "Сегмент"
+COL_TYPE    = "Тип"
+COL_SENT    = "Тональность"
+COL_LANG    = "Язык"
+COL_PRIO    = "Приоритет"
+COL_SUMMARY = "Рекомендации менеджеру"
+COL_MANAGER = "Назначенный Менеджер"
+COL_ROLE    = "Должность"
+COL_OFFICE  = "Офис Назначения"
+COL_ESC     = "Эскалирован"
+
+# Колонки с маленьким словарём значений — храним как category (int-коды вместо строк)
+CAT_COLS = [COL_SEG, COL_TYPE, COL_SENT, COL_LANG, "Приоритет_уровень",
+            COL_OFFICE, COL_MANAGER, COL_ROLE, COL_ESC, "AI_Источник", "Метод_гео"]
+
+# Уровень приоритета — векторно по всей колонке, без Python-вызова на строку
+def prio_labels(prio: pd.Series) -> np.ndarray:
+    n = pd.to_numeric(prio, errors="coerce").to_numpy(dtype=float)
+    labels = np.select([n >= 8, n >= 5], ["High", "Medium"], default="Low").astype(object)
+    # Нечисловые значения оставляем как есть (как раньше str(val))
+    bad = ~np.isfinite(n)
+    labels[bad] = [str(v) for v in prio.to_numpy()[bad]]
+    return labels
+
+AVAILABLE_COLS = ", ".join([
+    COL_SEG, COL_TYPE, COL_SENT, COL_LANG,
+    COL_PRIO, "Приоритет_уровень", COL_MANAGER, COL_ROLE, COL_OFFICE, COL_ESC
+])
+
+# ─── Загрузка данных ───────────────────────────────────────────────────────────
+
+# Только колонки, которые реально нужны дашборду (без id, assigned_manager_id):
+# DB-колонка → русское название из results.csv, переименование делает сам SELECT
+RESULT_DB_COLS = {
+    "ticket_id":               "ticket_id",
+    "ai_segment":              COL_SEG,
+    "ai_type":                 COL_TYPE,
+    "ai_sentiment":            COL_SENT,
+    "ai_language":             COL_LANG,
+    "ai_priority":             COL_PRIO,
+    "manager_recommendations": COL_SUMMARY,
+    "ai_attachments":          "Вложения",
+    "manager_name":            COL_MANAGER,
+    "manager_position":        COL_ROLE,
+    "ai_assigned_office":      COL_OFFICE,
+    "city_original":           "Город_оригинал",
+    "routing_reason":          "Причина_роутинга",
+    "ai_source":               "AI_Источник",
+    "geo_method":              "Метод_гео",
+    "is_escalated":            "is_escalated",
+}
+RESULTS_SQL = "SELECT {} FROM routing_routingresult".format(
+    ", ".join(col if col == alias else f'{col} AS "{alias}"'
+              for col, alias in RESULT_DB_COLS.items())
+)
+RESULTS_CHUNK = 50_000  # строк на блок при чтении результатов
+
+@st.cache_resource
+def get_engine():
+    """Один пул соединений на процесс — без connect/auth на каждый промах кэша."""
+    return create_engine(
+        URL.create(
+            "postgresql+psycopg2",
+            username=DB_USER, password=DB_PASS,
+            host=DB_HOST, port=int(DB_PORT), database=DB_NAME,
+        ),
+        pool_size=4, pool_pre_ping=True,
+    )
+
+def _read_managers(engine):
+    """Читает current_load прямо из таблицы routing_manager."""
+    try:
+        return pd.read_sql(
+            "SELECT full_name, current_load FROM routing_manager ORDER BY current_load DESC",
+            engine
+        )
+    except Exception:
+        return pd.DataFrame()
+
+def _read_results(engine):
+    """Результаты роутинга + производные колонки; ошибка возвращается, а не рисуется.
+
+    Функция выполняется в рабочем потоке, где st.* вызывать нельзя.
+    """
+    try:
+        # Блоками через server-side курсор: пик памяти — один блок, а не весь ответ
+        chunks = pd.read_sql(RESULTS_SQL, engine.execution_options(stream_results=True),
+                             chunksize=RESULTS_CHUNK)
+        df = pd.concat(chunks, ignore_index=True)
+
+        # is_escalated остаётся bool для масок и счётчиков; "Да"/"Нет" — только для показа
+        if "is_escalated" in df.columns:
+            esc = df["is_escalated"].fillna(False).to_numpy(dtype=bool)
+            df["is_escalated"] = esc
+            df[COL_ESC] = np.where(esc, "Да", "Нет")
+
+        # Производные колонки считаем здесь, внутри кэша, а не на каждом rerun
+        # Добавляем Язык если отсутствует (старые results.csv)
+        if COL_LANG not in df.columns:
+            df[COL_LANG] = "RU"
+        df["Приоритет_уровень"] = prio_labels(df[COL_PRIO])
+        for c in CAT_COLS:
+            if c in df.columns:
+                df[c] = df[c].astype("category")
+        # Остальной текст — Arrow-строки вместо Python-объектов: меньше памяти,
+        # сравнения в C и без поячеечного боксинга при отдаче в st.dataframe
+        for c in df.select_dtypes("object").columns:
+            df[c] = df[c].astype("string[pyarrow]")
+
+        return df, None
+    except Exception as e:
+        return pd.DataFrame(), e
+
+_DATA_VERSIONS = itertools.count(1)
+
+@st.cache_data(ttl=60)  # Кэшируем данные на 60 секунд
+def load_data_from_db():
+    """Результаты и нагрузка менеджеров одним кэшем: оба SELECT идут параллельно
+    по двум соединениям из пула, и страница ждёт один round-trip вместо двух."""
+    engine = get_engine()
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        results = pool.submit(_read_results, engine)
+        managers = pool.submit(_read_managers, engine)
+        (df, err), df_mgr = results.result(), managers.result()
+    if err is not None:
+        st.error(f"❌ Ошибка подключения к базе данных PostgreSQL: {err}")
+    # Версия выгрузки: новая на каждое чтение из БД, переживает кэш (pickle хранит attrs)
+    df.attrs["data_version"] = next(_DATA_VERSIONS)
+    return df, df_mgr
+
+# ─── Агрегаты ─────────────────────────────────────────────────────────────────
+
+def _df_fingerprint(d):
+    """Дешёвый ключ кэша вместо глубокого хэша всего DataFrame.
+
+    data_version отличает свежую выгрузку с тем же числом строк от старой.
+    """
+    return (d.attrs.get("data_version"), len(d), tuple(d.columns))
+
+def _cat_counts(col):
+    """value_counts для category: один bincount по int-кодам, только непустые."""
+    codes = col.cat.codes.to_numpy()
+    counts = np.bincount(codes[codes >= 0], minlength=len(col.cat.categories))
+    vc = pd.Series(counts, index=pd.Index(col.cat.categories, name=col.name), name="count")
+    return vc[vc > 0].sort_values(ascending=False, kind="stable")
+
+@st.cache_data(ttl=60, hash_funcs={pd.DataFrame: _df_fingerprint})
+def summarize(df):
+    """Все агрегаты для метрик и графиков — один раз на версию данных."""
+    # Маска эскалаций: одна на метрику и на блок эскалированных тикетов
+    if "is_escalated" in df.columns:
+        esc_mask = df["is_escalated"].to_numpy(dtype=bool)
+    elif COL_ESC in df.columns:
+        esc_mask = _eq(df[COL_ESC], "Да")
+    else:
+        # Подстроку ищем только среди категорий (десятки офисов), а по строкам
+        # сравниваем int-коды — без поиска подстроки в каждой ячейке
+        offices  = df[COL_OFFICE].cat
+        go_codes = np.flatnonzero([("ГО" in str(c)) for c in offices.categories])
+        esc_mask = np.isin(offices.codes.to_numpy(), go_codes)
+    return {
+        "total":          len(df),
+        # Считаем маски напрямую, без материализации отфильтрованных DataFrame
+        "vip_count":      int(np.count_nonzero(df[COL_SEG].isin(["VIP", "Priority"]).to_numpy())),
+        "spam_count":     int(np.count_nonzero(_eq(df[COL_TYPE], "Спам"))),
+        "highrisk_count": int(np.count_nonzero(df[COL_TYPE].isin(["Претензия", "Мошеннические действия"]).to_numpy())),
+        "esc_mask":       esc_mask,
+        "esc_count":      int(np.count_nonzero(esc_mask)),
+        "type_vc":        _cat_counts(df[COL_TYPE]),
+        "office_vc":      _cat_counts(df[COL_OFFICE]),
+        "prio_vc":        _cat_counts(df["Приоритет_уровень"]),
+        "sent_vc":        _cat_counts(df[COL_SENT]),
+        "seg_vc":         _cat_counts(df[COL_SEG]),
+        "mgr_vc":         _cat_counts(df[COL_MANAGER]),
+        # Опции фильтров-multiselect: категории уже уникальны и отсортированы
+        # (astype("category") сортирует их при выводе), без dropna/unique/sorted
+        "type_options":   df[COL_TYPE].cat.categories.tolist(),
+        "seg_options":    df[COL_SEG].cat.categories.tolist(),
+        "office_options": df[COL_OFFICE].cat.categories.tolist(),
+    }
+
+@st.cache_data(ttl=60)
+def make_bar(counts: pd.Series):
+    """Altair-спека bar chart — строится один раз на набор счётчиков, а не на каждый rerun."""
+    data = pd.DataFrame({"k": counts.index.astype(str), "v": counts.to_numpy()})
+    return alt.Chart(data).mark_bar().encode(
+        x=alt.X("k:N", sort=None, title=None),
+        y=alt.Y("v:Q", title=None),
+        tooltip=[alt.Tooltip("k:N", title=counts.index.name or ""),
+                 alt.Tooltip("v:Q", title="Кол-во")],
+    )
+
+# ─── Таблица ──────────────────────────────────────────────────────────────────
+
+def _eq(col, value):
+    """col == value; у category сравниваются int-коды, а не строки."""
+    if isinstance(col.dtype, pd.CategoricalDtype):
+        cats = col.cat.categories
+        if value not in cats:
+            return np.zeros(len(col), dtype=bool)
+        return col.cat.codes.to_numpy() == cats.get_loc(value)
+    return col.to_numpy() == value
+
+def style_prio(col):
+    return np.select(
+        [_eq(col, "High"), _eq(col, "Medium")],
+        ["color: red; font-weight: bold", "color: orange"],
+        default="color: green",
+    )
+
+def style_sent(col):
+    return np.where(_eq(col, "Legal Risk"), "color: red; font-weight: bold", "")
+
+def style_mgr(col):
+    return np.where(_eq(col, "Не найден"), "background-color: #ffcccc", "")
+
+def style_esc(col):
+    return np.where(_eq(col, "Да"), "color: #e67e22; font-weight: bold", "")
+
+# Подсветка по колонкам: каждая функция — один векторный проход по своей колонке
+TABLE_STYLES = {
+    "Приоритет_уровень": style_prio,
+    COL_SENT:            style_sent,
+    COL_MANAGER:         style_mgr,
+    COL_ESC:             style_esc,
+}
+
+def style_table(d):
+    """Styler с подсветкой только нужных колонок (apply subset=[col]), без CSS-матрицы на всю таблицу."""
+    styler = d.style
+    for col, fn in TABLE_STYLES.items():
+        if col in d.columns:
+            styler = styler.apply(fn, subset=[col])
+    return styler
+
+@st.cache_resource(ttl=60, hash_funcs={pd.DataFrame: _df_fingerprint})
+def to_arrow(df, cols):
+    """Arrow-таблица для нативного st.dataframe — конвертируем один раз на версию данных.
+
+    cache_resource, а не cache_data: таблица неизменяемая, и rerun получает тот же
+    объект, а не распаковывает из pickle свежую копию всей таблицы."""
+    return pa.Table.from_pandas(df[cols], preserve_index=False)
+
+# ─── Вложения ─────────────────────────────────────────────────────────────────
+
+@st.cache_data(ttl=300, max_entries=1024)
+def resolve_attachment(att_path: str, project_dir: str):
+    """Путь к файлу вложения или None; повторный выбор того же тикета — без stat-вызовов."""
+    # Ищем файл: сначала как есть, потом в папках data/ и attachments/
+    for p in (
+        att_path,
+        os.path.join(project_dir, att_path),
+        os.path.join(project_dir, "data", "attachments", att_path),
+        os.path.join(project_dir, "data", att_path),
+        os.path.join(project_dir, "attachments", att_path),
+    ):
+        if os.path.exists(p):
+            return p
+    return None
+
+# ─── AI-ассистент ─────────────────────────────────────────────────────────────
+
+# JSON-блок графика в ответе AI; компилируется один раз при импорте модуля
+_JSON_BLOCK_RE = re.compile(r'```json\s*(\{.*?\})\s*```', re.DOTALL)
+
+def extract_chart_spec(text: str):
+    """Извлекает JSON-спецификацию графика из ответа AI, если она есть."""
+    match = _JSON_BLOCK_RE.search(text)
+    if not match:
+        return None
+    try:
+        spec = json.loads(match.group(1))
+        if spec.get("action") == "chart":
+            return spec
+    except (json.JSONDecodeError, AttributeError):
+        pass
+    return None
+
+def strip_json_block(text: str) -> str:
+    """Убирает JSON-блок из текста, оставляя только читаемую часть ответа."""
+    return _JSON_BLOCK_RE.sub('', text).strip()
+
+@st.cache_resource
+def get_gemini_client(api_key: str):
+    """Один клиент Gemini на процесс — HTTPS-сессия переиспользуется между сообщениями."""
+    return genai.Client(api_key=api_key)
+
+@st.cache_data(ttl=60, hash_funcs={pd.DataFrame: _df_fingerprint})
+def build_data_context(df) -> str:
+    """Сводка датасета для промпта — один раз на версию данных, а не на каждое сообщение."""
+    summary = summarize(df)  # те же value_counts, что у метрик и графиков
+    return f"""Датасет FIRE Dashboard: {summary["total"]} тикетов.
+Доступные колонки для group_by: {AVAILABLE_COLS}
+Типы обращений: {summary["type_vc"].to_dict()}
+Тональности: {summary["sent_vc"].to_dict()}
+Офисы назначения: {summary["office_vc"].to_dict()}
+Сегменты: {summary["seg_vc"].to_dict()}
+Уровни приоритета: {summary["prio_vc"].to_dict()}
+Менеджеры (топ-5): {summary["mgr_vc"].drop('Не найден', errors='ignore').head(5).to_dict()}"""
+
+SYSTEM_PROMPT_TEMPLATE = """Ты — аналитический AI-ассистент дашборда FIRE (Freedom Intelligent Routing Engine).
+Ты помогаешь операторам анализировать данные по тикетам клиентов.
+Отвечай кратко и по делу на русском языке.
+
+ДАННЫЕ ПО ДАТАСЕТУ:
+{data_context}
+
+ПРАВИЛА ОТВЕТА:
+1. Если пользователь просит показать/построить ГРАФИК или ДИАГРАММУ — напиши 1-2 предложения с выводом, а затем добавь JSON-блок в точно таком формате:
+```json
+{{"action": "chart", "chart_type": "bar", "title": "Название графика", "group_by": "Название_колонки", "filter_col": null, "filter_val": null, "top_n": 10}}
+```
+Для сравнения двух колонок используй: "group_by": ["КолонкаА", "КолонкаБ"]
+Допустимые значения chart_type: "bar", "line"
+Используй ТОЛЬКО колонки из списка выше.
+
+2. Если вопрос аналитический — дай конкретный ответ с цифрами. Без JSON-блока."""
+
+@st.cache_data(ttl=60, hash_funcs={pd.DataFrame: _df_fingerprint})
+def build_system_prompt(df) -> str:
+    """Полный системный промпт — собирается один раз на версию данных."""
+    return SYSTEM_PROMPT_TEMPLATE.format(data_context=build_data_context(df))
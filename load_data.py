@@ -1,101 +1,140 @@
+import io
 import os
 import django
-import pandas as pd
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fire_project.settings')
 django.setup()
 
+from django.db import connection, transaction
 from routing.models import BusinessUnit, Manager, Ticket
+from routing.io_utils import (
+    build_office_resolver, clean_col, int_col, read_csv_fast, report_skipped, tickets_frame,
+)
 
-def clean_text(val):
-    if pd.isna(val):
-        return ""
-    return str(val).strip()
+BATCH_SIZE = 1000
+TICKET_FIELDS = ['gender', 'birth_date', 'description', 'attachments', 'segment',
+                 'country', 'region', 'city', 'street', 'house']
 
-def safe_int(val):
-    try:
-        if pd.isna(val) or val == "" or val == " ":
-            return 0
-        return int(float(val))
-    except (ValueError, TypeError):
-        return 0
+def bulk_upsert(model, key, rows):
+    """Аналог update_or_create для пачки строк: один SELECT + bulk_create + bulk_update.
+
+    rows — {значение ключа: {поле: значение}}. Возвращает (создано, обновлено).
+    """
+    existing = {getattr(obj, key): obj for obj in model.objects.filter(**{f'{key}__in': list(rows)})}
+    to_create, to_update = [], []
+    for key_val, defaults in rows.items():
+        obj = existing.get(key_val)
+        if obj is None:
+            to_create.append(model(**{key: key_val}, **defaults))
+        else:
+            for field, value in defaults.items():
+                setattr(obj, field, value)
+            to_update.append(obj)
+    model.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+    if to_update:
+        fields = list(next(iter(rows.values())).keys())
+        model.objects.bulk_update(to_update, fields, batch_size=BATCH_SIZE)
+    return len(to_create), len(to_update)
+
+def copy_upsert_tickets(df):
+    """COPY тикетов во временную таблицу + один INSERT ... ON CONFLICT (guid) DO UPDATE.
+
+    df — колонки guid + TICKET_FIELDS, guid уникален. Должна вызываться внутри
+    транзакции (временная таблица живёт до COMMIT). Возвращает (создано, обновлено).
+    """
+    table = Ticket._meta.db_table
+    cols = ['guid'] + TICKET_FIELDS
+    col_list = ', '.join(cols)
+
+    buf = io.StringIO()
+    df[cols].to_csv(buf, index=False, header=False, na_rep='\\N')
+    buf.seek(0)
+
+    with connection.cursor() as cur:
+        cur.execute(f"CREATE TEMP TABLE _stage_ticket ON COMMIT DROP AS "
+                    f"SELECT {col_list} FROM {table} WITH NO DATA")
+        # NULL '\N' — чтобы пустые строки не превращались в NULL (description NOT NULL)
+        cur.copy_expert(f"COPY _stage_ticket ({col_list}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf)
+        cur.execute(
+            f"INSERT INTO {table} ({col_list}) SELECT {col_list} FROM _stage_ticket "
+            f"ON CONFLICT (guid) DO UPDATE SET "
+            + ', '.join(f'{c} = EXCLUDED.{c}' for c in TICKET_FIELDS)
+            + " RETURNING (xmax = 0)"  # TRUE — строка вставлена, FALSE — обновлена
+        )
+        inserted = [row[0] for row in cur.fetchall()]
+    created = sum(inserted)
+    return created, len(inserted) - created
 
 def load_all():
+    # Все три загрузки — одна транзакция (один COMMIT); ошибка в блоке
+    # откатывает только его savepoint, остальные блоки продолжают работу
+    with transaction.atomic():
+        _load_all()
+
+def _load_all():
     # 1. Загрузка Офисов (ОБЯЗАТЕЛЬНО до менеджеров — FK зависимость)
     try:
-        path = os.path.join(BASE_DIR, 'data', 'business_units.csv')
-        df_offices = pd.read_csv(path, encoding='utf-8-sig', sep=',')
-        df_offices.columns = df_offices.columns.str.strip()
-        count = 0
-        for _, row in df_offices.iterrows():
-            name = clean_text(row.get('Офис'))
-            if name:
-                BusinessUnit.objects.update_or_create(
-                    name=name,
-                    defaults={'address': clean_text(row.get('Адрес', ''))}
-                )
-                count += 1
-        print(f"✅ Офисов загружено: {count}")
+        with transaction.atomic():
+            path = os.path.join(BASE_DIR, 'data', 'business_units.csv')
+            df_offices = read_csv_fast(path)
+            df_offices.columns = df_offices.columns.str.strip()
+            names     = clean_col(df_offices, 'Офис')
+            addresses = clean_col(df_offices, 'Адрес')
+            keep = names != ''
+            rows = {name: {'address': address}
+                    for name, address in zip(names[keep], addresses[keep])}
+            created, updated = bulk_upsert(BusinessUnit, 'name', rows)
+            print(f"✅ Офисов загружено: {created + updated} (новых: {created})")
     except Exception as e:
         print(f"❌ Ошибка офисов: {e}")
 
     # 2. Загрузка Менеджеров
     try:
-        path = os.path.join(BASE_DIR, 'data', 'managers.csv')
-        df_managers = pd.read_csv(path, encoding='utf-8-sig', sep=',')
-        df_managers.columns = df_managers.columns.str.strip()
-
-        count = 0
-        for _, row in df_managers.iterrows():
-            full_name = clean_text(row.get('ФИО'))
-            if full_name:
-                office_name = clean_text(row.get('Офис'))
-                office = BusinessUnit.objects.filter(name__icontains=office_name).first()
-                Manager.objects.update_or_create(
-                    full_name=full_name,
-                    defaults={
-                        'position':     clean_text(row.get('Должность')),
-                        'skills':       clean_text(row.get('Навыки')),
-                        'office':       office,
-                        'current_load': safe_int(row.get('Количество обращений в работе'))
+        with transaction.atomic():
+            path = os.path.join(BASE_DIR, 'data', 'managers.csv')
+            df_managers = read_csv_fast(path)
+            df_managers.columns = df_managers.columns.str.strip()
+
+            # Все офисы одним запросом вместо filter(name__icontains=...) на каждую строку
+            find_office_id = build_office_resolver(
+                BusinessUnit.objects.order_by('pk').values_list('name', 'id')
+            )
+
+            full_names   = clean_col(df_managers, 'ФИО')
+            office_names = clean_col(df_managers, 'Офис')
+
+            rows = {}
+            no_office = []
+            for full_name, office_name, position, skills, load in zip(
+                full_names, office_names,
+                clean_col(df_managers, 'Должность'), clean_col(df_managers, 'Навыки'),
+                int_col(df_managers, 'Количество обращений в работе'),
+            ):
+                if full_name:
+                    office_id = find_office_id(office_name)
+                    if office_id is None:
+                        no_office.append(f"{full_name} (офис: '{office_name}')")
+                        continue
+                    rows[full_name] = {
+                        'position':     position,
+                        'skills':       skills,
+                        'office_id':    office_id,
+                        'current_load': int(load),
                     }
-                )
-                count += 1
-        print(f"✅ Менеджеров загружено: {count}")
+            report_skipped("Офис не найден, менеджеров пропущено", no_office)
+            created, updated = bulk_upsert(Manager, 'full_name', rows)
+            print(f"✅ Менеджеров загружено: {created + updated} (новых: {created})")
     except Exception as e:
         print(f"❌ Ошибка менеджеров: {e}")
 
     # 3. Загрузка Тикетов
     try:
-        path = os.path.join(BASE_DIR, 'data', 'tickets.csv')
-        df_tickets = pd.read_csv(path, encoding='utf-8-sig', sep=',')
-        df_tickets.columns = df_tickets.columns.str.strip()
-
-        count = 0
-        for _, row in df_tickets.iterrows():
-            guid = clean_text(row.get('GUID клиента'))
-            if guid:
-                city_val = row.get('Населённый пункт')
-                if pd.isna(city_val):
-                    city_val = row.get('Населенный пункт')
-                Ticket.objects.update_or_create(
-                    guid=guid,
-                    defaults={
-                        'gender':      clean_text(row.get('Пол клиента')),
-                        'birth_date':  clean_text(row.get('Дата рождения')),
-                        'description': clean_text(row.get('Описание')),
-                        'attachments': clean_text(row.get('Вложения')),
-                        'segment':     clean_text(row.get('Сегмент клиента')),
-                        'country':     clean_text(row.get('Страна')),
-                        'region':      clean_text(row.get('Область')),
-                        'city':        clean_text(city_val),
-                        'street':      clean_text(row.get('Улица')),
-                        'house':       clean_text(row.get('Дом'))
-                    }
-                )
-                count += 1
-        print(f"✅ Тикетов загружено: {count}")
+        with transaction.atomic():
+            path = os.path.join(BASE_DIR, 'data', 'tickets.csv')
+            tickets = tickets_frame(read_csv_fast(path, raw_text=True))
+            created, updated = copy_upsert_tickets(tickets)
+            print(f"✅ Тикетов загружено: {created + updated} (новых: {created})")
     except Exception as e:
         print(f"❌ Ошибка тикетов: {e}")
 
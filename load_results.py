@@ -1,107 +1,154 @@
 import os
 import sys
-import io
-
-# ─── ФОРСИРУЕМ UTF-8 ДЛЯ КОНСОЛИ ───────────────────────────────────────────
-if sys.stdout.encoding != 'utf-8':
-    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-# ───────────────────────────────────────────────────────────────────────────
-
-import django
-import pandas as pd
+from collections import Counter
 
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 if BASE_DIR not in sys.path:
     sys.path.insert(0, BASE_DIR)
 
-os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fire_project.settings')
-django.setup()
-
-from routing.models import Ticket, Manager, RoutingResult
-from django.db.models import Q
-
-def clean_text(val):
-    if pd.isna(val):
-        return ""
-    return str(val).strip()
-
-def load_results():
-    print("📥 Начинаем загрузку новых результатов ИИ...")
+from routing.io_utils import clean_col, read_csv_fast, report_skipped
+
+BATCH_SIZE = 1000
+
+# Поле RoutingResult → колонка results.csv
+RESULT_FIELDS = {
+    'ai_segment':             'Сегмент',
+    'ai_type':                'Тип',
+    'ai_sentiment':           'Тональность',
+    'ai_language':            'Язык',
+    'ai_priority':            'Приоритет',
+    'manager_recommendations':'Рекомендации менеджеру',
+    'ai_attachments':         'Вложения',
+    'manager_name':           'Назначенный Менеджер',
+    'manager_position':       'Должность',
+    'ai_assigned_office':     'Офис Назначения',
+    'is_escalated':           'Эскалирован',
+    'city_original':          'Город_оригинал',
+    'routing_reason':         'Причина_роутинга',
+    'ai_source':              'AI_Источник',
+    'geo_method':             'Метод_гео',
+}
+
+def build_manager_index(managers):
+    """Индекс менеджеров для find_manager: (ФИО.casefold() → первый по pk менеджер,
+    [(ФИО.casefold(), менеджер)] в порядке pk). ФИО нормализуются один раз, а не на каждый поиск."""
+    index, folded = {}, []
+    for m in managers:
+        key = m.full_name.casefold()
+        index.setdefault(key, m)
+        folded.append((key, m))
+    return index, folded
+
+def find_manager(name, index, folded):
+    """Как Manager.objects.filter(full_name__icontains=name).first(), но в памяти:
+    сначала точное совпадение из словаря, подстрока — только если его нет."""
+    needle = name.casefold()
+    return index.get(needle) or next((m for key, m in folded if needle in key), None)
+
+def _load_results(verbose):
+    from routing.models import Ticket, Manager, RoutingResult
+
+    csv_path = next(
+        (p for p in [
+            os.path.join(BASE_DIR, 'data', 'results.csv'),
+            os.path.join(BASE_DIR, 'results.csv'),
+        ] if os.path.exists(p)),
+        os.path.join(BASE_DIR, 'data', 'results.csv')
+    )
+    print(f"📂 Читаем: {csv_path}")
+    df = read_csv_fast(csv_path)
     
-    try:
-        csv_path = next(
-            (p for p in [
-                os.path.join(BASE_DIR, 'data', 'results.csv'),
-                os.path.join(BASE_DIR, 'results.csv'),
-            ] if os.path.exists(p)),
-            os.path.join(BASE_DIR, 'data', 'results.csv')
-        )
-        print(f"📂 Читаем: {csv_path}")
-        df = pd.read_csv(csv_path, encoding='utf-8-sig', sep=',')
-        
-        created_count = 0
-        updated_count = 0
-
-        for _, row in df.iterrows():
-            guid = clean_text(row.get('GUID'))
-            if not guid:
-                continue
-                
-            ticket = Ticket.objects.filter(guid=guid).first()
-            if not ticket:
-                print(f"⚠️ Тикет {guid} не найден. Пропускаем.")
-                continue
-                
-            manager_name = clean_text(row.get('Назначенный Менеджер'))
-            new_manager = None
-            if manager_name and manager_name not in ['Не найден', '-']:  
-                new_manager = Manager.objects.filter(full_name__icontains=manager_name).first()
-
-            # Обновляем или создаем запись
-            result, created = RoutingResult.objects.update_or_create(
-                ticket=ticket,
-                defaults={
-                    'ai_segment':             clean_text(row.get('Сегмент')),
-                    'ai_type':                clean_text(row.get('Тип')),
-                    'ai_sentiment':           clean_text(row.get('Тональность')),
-                    'ai_language':            clean_text(row.get('Язык')),
-                    'ai_priority':            clean_text(row.get('Приоритет')),
-                    'manager_recommendations':clean_text(row.get('Рекомендации менеджеру')),
-                    'ai_attachments':         clean_text(row.get('Вложения')),
-                    'manager_name':           manager_name,
-                    'manager_position':       clean_text(row.get('Должность')),
-                    'ai_assigned_office':     clean_text(row.get('Офис Назначения')),
-                    'is_escalated':           clean_text(row.get('Эскалирован')) == 'Да',
-                    'city_original':          clean_text(row.get('Город_оригинал')),
-                    'routing_reason':         clean_text(row.get('Причина_роутинга')),
-                    'ai_source':              clean_text(row.get('AI_Источник')),
-                    'geo_method':             clean_text(row.get('Метод_гео')),
-                    'assigned_manager':       new_manager,
-                }
-            )
+    created_count = 0
+    updated_count = 0
+
+    # Всё, что раньше запрашивалось на каждую строку, — одним запросом заранее
+    guids      = clean_col(df, 'GUID').tolist()
+    cleaned    = {field: clean_col(df, col) for field, col in RESULT_FIELDS.items()}
+    cleaned['is_escalated'] = cleaned['is_escalated'].eq('Да')
+    cols       = {field: values.tolist() for field, values in cleaned.items()}
+    ticket_map = dict(Ticket.objects.filter(guid__in=set(guids)).values_list('guid', 'id'))
+    # Только для счётчиков «создано/обновлено» — запись идёт одним upsert ниже
+    existing   = set(RoutingResult.objects.filter(ticket_id__in=ticket_map.values())
+                     .values_list('ticket_id', flat=True))
+    managers   = list(Manager.objects.order_by('pk'))  # .first() берёт наименьший pk
+    manager_index, folded_names = build_manager_index(managers)
+    manager_cache = {}
+
+    # ticket_id → RoutingResult; повтор GUID в CSV перезаписывает, как update_or_create
+    pending = {}
+    missing = []  # GUID без тикета в БД — одной сводкой после цикла
+    for i, guid in enumerate(guids):
+        if not guid:
+            continue
+
+        ticket_id = ticket_map.get(guid)
+        if ticket_id is None:
+            missing.append(guid)
+            continue
             
-            if created:
-                created_count += 1
-            else:
-                updated_count += 1
-
-        print(f"✅ Готово! Создано: {created_count}, Обновлено: {updated_count}")
-
-        # Прибавляем AI-тикеты к текущему значению в PostgreSQL
-        print("🔄 Обновляем нагрузку менеджеров...")
-        for m in Manager.objects.all():
-            m.refresh_from_db()  # читаем актуальное значение из Postgres
-            old_load = m.current_load
-
-            # Считаем по FK
-            fk_count = RoutingResult.objects.filter(assigned_manager=m).count()
-            # Считаем по текстовому совпадению (fallback)
-            name_count = RoutingResult.objects.filter(manager_name=m.full_name).count()
-            # Итого без дублей
-            ai_count = RoutingResult.objects.filter(
-                Q(assigned_manager=m) | Q(manager_name=m.full_name)
-            ).distinct().count()
+        manager_name = cols['manager_name'][i]
+        new_manager = None
+        if manager_name and manager_name not in ['Не найден', '-']:  
+            if manager_name not in manager_cache:
+                manager_cache[manager_name] = find_manager(manager_name, manager_index, folded_names)
+            new_manager = manager_cache[manager_name]
+
+        fields = {field: values[i] for field, values in cols.items()}
+
+        if ticket_id in pending or ticket_id in existing:
+            updated_count += 1
+        else:
+            created_count += 1
+        pending[ticket_id] = RoutingResult(
+            ticket_id=ticket_id, assigned_manager=new_manager, **fields,
+        )
 
+    # INSERT ... ON CONFLICT (ticket_id) DO UPDATE — новые и существующие результаты
+    # одним запросом на пачку вместо bulk_create + bulk_update (CASE WHEN по id)
+    RoutingResult.objects.bulk_create(
+        pending.values(), batch_size=BATCH_SIZE,
+        update_conflicts=True, unique_fields=['ticket'],
+        update_fields=[*RESULT_FIELDS, 'assigned_manager'],
+    )
+
+    report_skipped("Тикеты не найдены, пропущено", missing)
+    print(f"✅ Готово! Создано: {created_count}, Обновлено: {updated_count}")
+
+    update_manager_loads(verbose)
+
+def update_manager_loads(verbose=False):
+    """Прибавляет к current_load каждого менеджера число RoutingResult, где он
+    назначен по FK или по manager_name (строка, совпавшая по обоим, — один раз)."""
+    from django.db.models import Count
+    from routing.models import Manager, RoutingResult
+
+    # Прибавляем AI-тикеты к текущему значению в PostgreSQL
+    print("🔄 Обновляем нагрузку менеджеров...")
+    # Один GROUP BY вместо трёх COUNT на менеджера: группы (FK, имя) не пересекаются,
+    # поэтому «FK или имя» = по FK + по имени − общая группа (FK, имя)
+    fk_counts, name_counts, pair_counts = Counter(), Counter(), {}
+    for row in (RoutingResult.objects.order_by()
+                .values('assigned_manager_id', 'manager_name')
+                .annotate(c=Count('id'))):
+        fk_counts[row['assigned_manager_id']] += row['c']
+        name_counts[row['manager_name']] += row['c']
+        pair_counts[(row['assigned_manager_id'], row['manager_name'])] = row['c']
+
+    managers = list(Manager.objects.all())
+    total_ai = 0
+    for m in managers:
+        old_load = m.current_load
+
+        # Считаем по FK
+        fk_count = fk_counts[m.id]
+        # Считаем по текстовому совпадению (fallback)
+        name_count = name_counts[m.full_name]
+        # Итого без дублей
+        ai_count = fk_count + name_count - pair_counts.get((m.id, m.full_name), 0)
+
+        # Подробный разбор по каждому менеджеру — только с --verbose:
+        # шесть print на менеджера заметно тормозят вывод в консоль Windows
+        if verbose:
             print(f"  [{m.full_name}]")
             print(f"    📖 old_load из БД = {old_load}")
             print(f"    🔗 по FK          = {fk_count}")
@@ -109,12 +156,42 @@ def load_results():
             print(f"    ✅ итого (distinct)= {ai_count}")
             print(f"    💾 new_load       = {old_load} + {ai_count} = {old_load + ai_count}")
 
-            m.current_load = old_load + ai_count
-            m.save()
-        print("✅ Нагрузка успешно обновлена!")
+        m.current_load = old_load + ai_count
+        total_ai += ai_count
+    Manager.objects.bulk_update(managers, ['current_load'], batch_size=BATCH_SIZE)
+    print(f"  Менеджеров: {len(managers)}, прибавлено AI-тикетов: {total_ai}")
+    print("✅ Нагрузка успешно обновлена!")
+
+def load_results(verbose=False):
+    """Загрузка results.csv в БД; Django должен быть уже настроен (django.setup()).
 
+    verbose — печатать расчёт нагрузки по каждому менеджеру.
+    """
+    from django.db import connection, transaction
+
+    print("📥 Начинаем загрузку новых результатов ИИ...")
+    
+    try:
+        # Вся загрузка — одна транзакция: один COMMIT вместо одного на каждый запрос,
+        # а при ошибке ничего не записывается наполовину
+        with transaction.atomic():
+            with connection.cursor() as cur:
+                # Разовый bulk-load: не ждём fsync WAL на COMMIT (при сбое ОС теряется
+                # только эта загрузка, целостность БД не страдает — её можно просто повторить)
+                cur.execute("SET LOCAL synchronous_commit = OFF")
+            _load_results(verbose)
     except Exception as e:
         print(f"❌ Ошибка: {e}")
 
 if __name__ == '__main__':
-    load_results()
\ No newline at end of file
+    # ─── ФОРСИРУЕМ UTF-8 ДЛЯ КОНСОЛИ ───────────────────────────────────────
+    # reconfigure меняет кодировку самого потока — без лишней обёртки TextIOWrapper
+    if sys.stdout.encoding != 'utf-8':
+        sys.stdout.reconfigure(encoding='utf-8')
+
+    # Django настраиваем только при запуске скриптом: импорт модуля без побочных эффектов
+    import django
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'fire_project.settings')
+    django.setup()
+
+    load_results(verbose='--verbose' in sys.argv[1:])
\ No newline at end of file
@@ -12,23 +12,24 @@ reset_all.py — Полный сброс системы FIRE
   python load_results.py
 """
 
+import io
 import os
 import sys
-import subprocess
 
 import psycopg2
 import pandas as pd
-from dotenv import load_dotenv
 
-load_dotenv()
+from routing.io_utils import (
+    build_office_resolver, clean_col, dedupe_last, get_db_config, int_col, read_csv_fast,
+    report_skipped, tickets_frame,
+)
 
-DB_HOST = os.getenv("DB_HOST", "localhost")
-DB_PORT = os.getenv("DB_PORT", "5433")
-DB_USER = os.getenv("DB_USER", "postgres")
-DB_PASS = os.getenv("DB_PASS", "1234")
-DB_NAME = os.getenv("DB_NAME", "fire_db")
+DB      = get_db_config()
+DB_HOST = DB["host"]
+DB_PORT = DB["port"]
+DB_NAME = DB["dbname"]
 
-# Настраиваем Django ДО django.setup() — вызовем его после migrate
+# Настраиваем Django ДО django.setup() — вызовем его перед migrate, после пересоздания БД
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fire_project.settings")
 
 # ─── Helpers ────────────────────────────────────────────────────────────────
@@ -38,19 +39,6 @@ def step(n, msg):
     print(f"  {n}  {msg}")
     print(f"{'─'*55}")
 
-def clean(val):
-    if pd.isna(val):
-        return ""
-    return str(val).strip()
-
-def safe_int(val):
-    try:
-        if pd.isna(val) or str(val).strip() == "":
-            return 0
-        return int(float(val))
-    except (ValueError, TypeError):
-        return 0
-
 # ─── Шаги ───────────────────────────────────────────────────────────────────
 
 def delete_results_csv():
@@ -69,9 +57,7 @@ def recreate_database():
     step("2/4", f"Пересоздание БД  '{DB_NAME}'  на {DB_HOST}:{DB_PORT}")
     try:
         conn = psycopg2.connect(
-            host=DB_HOST, port=DB_PORT,
-            user=DB_USER, password=DB_PASS,
-            dbname="postgres"          # подключаемся к системной БД, не к fire_db
+            **{**DB, "dbname": "postgres"}  # подключаемся к системной БД, не к fire_db
         )
         conn.autocommit = True
         cur = conn.cursor()
@@ -98,12 +84,15 @@ def recreate_database():
 
 def run_migrations():
     step("3/4", "Django migrate  (применяем все миграции)")
-    result = subprocess.run(
-        ["python", "manage.py", "migrate"],
-        capture_output=False   # вывод сразу в консоль
-    )
-    if result.returncode != 0:
-        print("  ❌ migrate завершился с ошибкой")
+    # migrate в этом же процессе: без второго интерпретатора и повторного импорта Django;
+    # настроенный здесь Django использует и загрузка данных (шаг 4)
+    import django
+    from django.core.management import call_command
+    try:
+        django.setup()
+        call_command("migrate")   # вывод сразу в консоль
+    except Exception as e:
+        print(f"  ❌ migrate завершился с ошибкой: {e}")
         sys.exit(1)
     print("  ✅ Все миграции применены")
 
@@ -111,25 +100,43 @@ def run_migrations():
 def load_initial_data():
     step("4/4", "Загрузка начальных данных: офисы → менеджеры → тикеты")
 
-    import django
-    django.setup()
+    # Django уже настроен в run_migrations()
+    from django.db import connection, transaction
+
+    # Все три загрузки — одна транзакция: один COMMIT вместо одного на каждую строку;
+    # sys.exit при ошибке откатывает её целиком, а не оставляет БД загруженной наполовину
+    with transaction.atomic():
+        with connection.cursor() as cur:
+            # Свежая БД грузится заново целиком — fsync на COMMIT не ждём
+            cur.execute("SET LOCAL synchronous_commit = OFF")
+            _load_initial_data(cur)
+
+
+def copy_rows(cur, table, df):
+    """COPY ... FROM STDIN: все строки df одним потоком; колонки df = колонки таблицы."""
+    buf = io.StringIO()
+    df.to_csv(buf, index=False, header=False, na_rep="\\N")
+    buf.seek(0)
+    cols = ", ".join(df.columns)
+    # NULL '\N' — чтобы пустые строки не превращались в NULL (description NOT NULL)
+    cur.copy_expert(f"COPY {table} ({cols}) FROM STDIN WITH (FORMAT csv, NULL '\\N')", buf)
+
+
+def _load_initial_data(cur):
+    # Таблицы только что созданы (шаги 2–3), поэтому вместо update_or_create
+    # на каждую строку — сразу COPY в PostgreSQL
     from routing.models import BusinessUnit, Manager, Ticket
 
     # ── 4a. Офисы ─────────────────────────────────────────────────────────
     print("\n  ► Офисы (data/business_units.csv)...")
     try:
-        df = pd.read_csv("data/business_units.csv", encoding="utf-8-sig")
+        df = read_csv_fast("data/business_units.csv")
         df.columns = df.columns.str.strip()
-        count = 0
-        for _, row in df.iterrows():
-            name = clean(row.get("Офис"))
-            if name:
-                BusinessUnit.objects.update_or_create(
-                    name=name,
-                    defaults={"address": clean(row.get("Адрес", ""))}
-                )
-                count += 1
-        print(f"  ✅ Офисов загружено: {count}")
+        # Чистим колонки целиком строковыми операциями pandas, а не clean() на каждую ячейку
+        df = pd.DataFrame({"name": clean_col(df, "Офис"), "address": clean_col(df, "Адрес")})
+        df = df[df["name"] != ""]
+        copy_rows(cur, BusinessUnit._meta.db_table, dedupe_last(df, "name"))
+        print(f"  ✅ Офисов загружено: {len(df)}")
     except Exception as e:
         print(f"  ❌ Ошибка при загрузке офисов: {e}")
         sys.exit(1)
@@ -137,29 +144,41 @@ def load_initial_data():
     # ── 4b. Менеджеры ─────────────────────────────────────────────────────
     print("\n  ► Менеджеры (data/managers.csv)...")
     try:
-        df = pd.read_csv("data/managers.csv", encoding="utf-8-sig")
+        df = read_csv_fast("data/managers.csv")
         df.columns = df.columns.str.strip()
-        count = 0
-        for _, row in df.iterrows():
-            full_name = clean(row.get("ФИО"))
-            if not full_name:
-                continue
-            office_name = clean(row.get("Офис", ""))
-            office = BusinessUnit.objects.filter(name__icontains=office_name).first() if office_name else None
-            if office is None:
-                print(f"    ⚠️  Офис не найден для менеджера '{full_name}' (офис: '{office_name}')")
-                continue
-            Manager.objects.update_or_create(
-                full_name=full_name,
-                defaults={
-                    "position":     clean(row.get("Должность", "")),
-                    "skills":       clean(row.get("Навыки", "")),
-                    "office":       office,
-                    "current_load": safe_int(row.get("Количество обращений в работе", 0)),
-                }
-            )
-            count += 1
-        print(f"  ✅ Менеджеров загружено: {count}")
+
+        # Офисы — один запрос; дальше поиск в памяти вместо LIKE '%...%' на каждую строку
+        find_office = build_office_resolver(
+            BusinessUnit.objects.order_by("pk").values_list("name", "id")
+        )
+
+        df = pd.DataFrame({
+            "full_name":   clean_col(df, "ФИО"),
+            "office_name": clean_col(df, "Офис"),
+            "position":    clean_col(df, "Должность"),
+            "skills":      clean_col(df, "Навыки"),
+            # Вся колонка сразу через to_numeric, без try/except на каждую ячейку
+            "load":        int_col(df, "Количество обращений в работе"),
+        })
+        df = df[df["full_name"] != ""]
+        office_ids = [find_office(name) if name else None for name in df["office_name"]]
+        found = pd.notna(pd.Series(office_ids, index=df.index, dtype=object))
+        report_skipped(
+            "Офис не найден, менеджеров пропущено",
+            [f"{full_name} (офис: '{office_name}')" for full_name, office_name
+             in df.loc[~found, ["full_name", "office_name"]].itertuples(index=False, name=None)],
+            indent="    ",
+        )
+
+        managers = pd.DataFrame({
+            "full_name":    df["full_name"],
+            "position":     df["position"],
+            "skills":       df["skills"],
+            "current_load": df["load"],
+            "office_id":    pd.Series(office_ids, index=df.index, dtype=object),
+        })[found]
+        copy_rows(cur, Manager._meta.db_table, dedupe_last(managers, "full_name"))
+        print(f"  ✅ Менеджеров загружено: {len(managers)}")
     except Exception as e:
         print(f"  ❌ Ошибка при загрузке менеджеров: {e}")
         sys.exit(1)
@@ -167,34 +186,9 @@ def load_initial_data():
     # ── 4c. Тикеты ────────────────────────────────────────────────────────
     print("\n  ► Тикеты (data/tickets.csv)...")
     try:
-        df = pd.read_csv("data/tickets.csv", encoding="utf-8-sig")
-        df.columns = df.columns.str.strip()
-        count = 0
-        for _, row in df.iterrows():
-            guid = clean(row.get("GUID клиента"))
-            if not guid:
-                continue
-            # Поддержка обоих написаний буквы ё
-            city = row.get("Населённый пункт")
-            if pd.isna(city):
-                city = row.get("Населенный пункт")
-            Ticket.objects.update_or_create(
-                guid=guid,
-                defaults={
-                    "gender":      clean(row.get("Пол клиента")),
-                    "birth_date":  clean(row.get("Дата рождения")),
-                    "description": clean(row.get("Описание")),
-                    "attachments": clean(row.get("Вложения")),
-                    "segment":     clean(row.get("Сегмент клиента")),
-                    "country":     clean(row.get("Страна")),
-                    "region":      clean(row.get("Область")),
-                    "city":        clean(city),
-                    "street":      clean(row.get("Улица")),
-                    "house":       clean(row.get("Дом")),
-                }
-            )
-            count += 1
-        print(f"  ✅ Тикетов загружено: {count}")
+        df = tickets_frame(read_csv_fast("data/tickets.csv", raw_text=True))
+        copy_rows(cur, Ticket._meta.db_table, df)
+        print(f"  ✅ Тикетов загружено: {len(df)}")
     except Exception as e:
         print(f"  ❌ Ошибка при загрузке тикетов: {e}")
         sys.exit(1)
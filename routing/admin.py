@@ -26,6 +26,8 @@ class TicketAdmin(admin.ModelAdmin):
     list_filter = ('segment', 'city')
     search_fields = ('guid', 'description')
     inlines = [RoutingResultInline]
+    # Колонки ИИ и менеджер — одним JOIN, а не два запроса на каждую строку списка
+    list_select_related = ('ai_result', 'ai_result__assigned_manager')
 
     def get_ai_type(self, obj):
         return obj.ai_result.ai_type if hasattr(obj, 'ai_result') else "-"
@@ -46,4 +48,6 @@ class RoutingResultAdmin(admin.ModelAdmin):
     # Обновили колонки под новые данные
     list_display = ('ticket', 'ai_type', 'ai_priority', 'ai_sentiment', 'ai_assigned_office', 'assigned_manager')
     list_filter = ('ai_type', 'ai_priority', 'ai_sentiment', 'ai_language', 'ai_assigned_office')
-    search_fields = ('ticket__guid', 'manager_recommendations')
\ No newline at end of file
+    search_fields = ('ticket__guid', 'manager_recommendations')
+    # assigned_manager nullable — автоматический select_related() его не подтягивает
+    list_select_related = ('ticket', 'assigned_manager')
\ No newline at end of file
@@ -0,0 +1,127 @@
+"""
+Общие помощники CLI-скриптов (start.py, reset_all.py, load_data.py, load_results.py).
+
+Модуль не трогает Django — его можно импортировать до django.setup().
+"""
+
+import os
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+
+@lru_cache(maxsize=None)
+def get_db_config():
+    """Параметры PostgreSQL из .env / окружения — .env читается один раз на процесс.
+
+    Ключи совпадают с аргументами psycopg2.connect().
+    """
+    try:
+        from dotenv import load_dotenv
+        load_dotenv()
+    except ImportError:
+        pass
+    return {
+        "host":     os.getenv("DB_HOST", "localhost"),
+        "port":     os.getenv("DB_PORT", "5433"),
+        "user":     os.getenv("DB_USER", "postgres"),
+        "password": os.getenv("DB_PASS", "1234"),
+        "dbname":   os.getenv("DB_NAME", "fire_db"),
+    }
+
+
+def read_csv_fast(path, raw_text=False, **kwargs):
+    """read_csv для файлов из data/: BOM-safe UTF-8, pyarrow-движок (многопоточный парсер на C++).
+
+    raw_text=True — все колонки как исходный текст. pyarrow сам угадывает типы
+    (ISO-дату "2002-07-11 00:00:00" превращает в "2002-07-11"), и dtype=str это
+    не отменяет — pandas применяет его уже после разбора, поэтому здесь C-движок.
+    """
+    if raw_text:
+        return pd.read_csv(path, encoding="utf-8-sig", sep=",", dtype=str, **kwargs)
+    return pd.read_csv(path, encoding="utf-8-sig", sep=",", engine="pyarrow", **kwargs)
+
+
+def clean_col(df, name):
+    """clean для целой колонки: NaN → "", str + strip (нет колонки → "")."""
+    if name not in df.columns:
+        return pd.Series("", index=df.index)
+    return df[name].fillna("").astype(str).str.strip()
+
+
+def int_col(df, name):
+    """Колонка → int64: пустое/нечисловое → 0, дробное усекаем к нулю, как int()."""
+    if name not in df.columns:
+        return pd.Series(0, index=df.index, dtype="int64")
+    # Один проход в C по float-массиву: NaN/inf → 0, остальное усекаем к нулю как int()
+    vals = pd.to_numeric(df[name], errors="coerce").to_numpy(dtype="float64")
+    vals = np.where(np.isfinite(vals), vals, 0.0)
+    return pd.Series(vals.astype("int64"), index=df.index)
+
+
+def dedupe_last(df, key):
+    """Одна строка на ключ, как после серии update_or_create:
+    значения — из последнего вхождения (целиком, с пустыми), порядок (и pk) — по первому."""
+    last = df.drop_duplicates(key, keep="last").set_index(key)
+    return last.loc[df[key].unique()].reset_index()[list(df.columns)]
+
+
+def tickets_frame(df):
+    """tickets.csv → колонки таблицы Ticket: очищенные строки, без пустых GUID, один ряд на GUID."""
+    df.columns = df.columns.str.strip()
+    # Поддержка обоих написаний буквы ё: берём «Населённый пункт», пустые — из «Населенный пункт»
+    city = df.get("Населённый пункт", pd.Series(index=df.index, dtype=object))
+    if "Населенный пункт" in df.columns:
+        city = city.combine_first(df["Населенный пункт"])
+    df = df.assign(_city=city)
+    tickets = pd.DataFrame({
+        "guid":        clean_col(df, "GUID клиента"),
+        "gender":      clean_col(df, "Пол клиента"),
+        "birth_date":  clean_col(df, "Дата рождения"),
+        "description": clean_col(df, "Описание"),
+        "attachments": clean_col(df, "Вложения"),
+        "segment":     clean_col(df, "Сегмент клиента"),
+        "country":     clean_col(df, "Страна"),
+        "region":      clean_col(df, "Область"),
+        "city":        clean_col(df, "_city"),
+        "street":      clean_col(df, "Улица"),
+        "house":       clean_col(df, "Дом"),
+    })
+    return dedupe_last(tickets[tickets["guid"] != ""], "guid")
+
+
+def build_office_resolver(offices):
+    """Замена BusinessUnit.objects.filter(name__icontains=...).first() без запроса на строку.
+
+    offices — пары (name, pk) в порядке pk. Возвращает функцию название → pk или None:
+    сначала нормализованное имя (strip + lower) из словаря, иначе первая подстрока без
+    учёта регистра. Результат запоминается на каждое встреченное название.
+    """
+    offices = list(offices)
+    lookup = {}
+    for name, pk in offices:
+        lookup.setdefault(name.strip().lower(), pk)
+    cache = {}
+
+    def resolve(office_name):
+        if office_name not in cache:
+            needle = office_name.strip().lower()
+            pk = lookup.get(needle)
+            if pk is None:
+                pk = next((pk for name, pk in offices if needle in name.lower()), None)
+            cache[office_name] = pk
+        return cache[office_name]
+
+    return resolve
+
+
+def report_skipped(message, items, limit=10, indent=""):
+    """Одна сводка вместо print на каждую пропущенную строку: счётчик и первые limit примеров."""
+    if not items:
+        return
+    print(f"{indent}⚠️ {message}: {len(items)}")
+    for item in items[:limit]:
+        print(f"{indent}    · {item}")
+    if len(items) > limit:
+        print(f"{indent}    … и ещё {len(items) - limit}")
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('routing', '0007_routingresult_ai_attachments'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='manager',
+            index=models.Index(fields=['full_name'], name='routing_man_full_na_773fc1_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='routingresult',
+            index=models.Index(fields=['manager_name'], name='routing_rou_manager_28789b_idx'),
+        ),
+    ]
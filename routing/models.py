@@ -11,6 +11,10 @@ class Manager(models.Model):
     current_load = models.IntegerField(default=0)
     office = models.ForeignKey(BusinessUnit, on_delete=models.CASCADE)
 
+    class Meta:
+        # Поиск менеджера по ФИО при загрузке данных и пересчёте нагрузки
+        indexes = [models.Index(fields=['full_name'])]
+
 class Ticket(models.Model):
     # Точная копия колонок из tickets.csv
     guid = models.CharField(max_length=255, unique=True, verbose_name="GUID клиента")
@@ -56,5 +60,10 @@ class RoutingResult(models.Model):
     # FK-связь с менеджером в БД (опциональная)
     assigned_manager = models.ForeignKey(Manager, on_delete=models.SET_NULL, null=True, blank=True, verbose_name="FK Менеджер")
 
+    class Meta:
+        # Пересчёт нагрузки группирует результаты по manager_name;
+        # assigned_manager — FK, индекс на него Django создаёт сам
+        indexes = [models.Index(fields=['manager_name'])]
+
     def __str__(self):
         return f"Результат ИИ для {self.ticket.guid}"
\ No newline at end of file
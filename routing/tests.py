@@ -1,3 +1,119 @@
-from django.test import TestCase
+import os
+import tempfile
 
-# Create your tests here.
+from contextlib import redirect_stdout
+from io import StringIO
+
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase
+
+from load_results import build_manager_index, find_manager, update_manager_loads
+from routing.io_utils import build_office_resolver, clean_col, read_csv_fast, tickets_frame
+from routing.models import BusinessUnit, Manager, RoutingResult, Ticket
+
+
+class CsvFileMixin:
+    def write_csv(self, text):
+        fd, path = tempfile.mkstemp(suffix=".csv")
+        with os.fdopen(fd, "w", encoding="utf-8-sig") as f:
+            f.write(text)
+        self.addCleanup(os.remove, path)
+        return path
+
+
+class ReadCsvFastTests(CsvFileMixin, SimpleTestCase):
+    def test_raw_text_keeps_iso_birth_date(self):
+        path = self.write_csv(
+            "GUID клиента,Дата рождения,Дом\n"
+            "a,2002-07-11 00:00:00,9\n"
+            "b,1990-01-01 00:00:00,\n"
+        )
+        df = read_csv_fast(path, raw_text=True)
+        self.assertEqual(clean_col(df, "Дата рождения").tolist(),
+                         ["2002-07-11 00:00:00", "1990-01-01 00:00:00"])
+        self.assertEqual(clean_col(df, "Дом").tolist(), ["9", ""])
+
+
+class TicketsFrameTests(CsvFileMixin, SimpleTestCase):
+    def test_keeps_last_values_in_first_order(self):
+        path = self.write_csv(
+            "GUID клиента ,Населенный пункт,Дом\n"
+            "a,Алматы,1\n"
+            "b,Астана,2\n"
+            "a,,3\n"
+            ",Шымкент,4\n"
+        )
+        tickets = tickets_frame(read_csv_fast(path, raw_text=True))
+        self.assertEqual(tickets["guid"].tolist(), ["a", "b"])
+        self.assertEqual(tickets["city"].tolist(), ["", "Астана"])  # пустое значение тоже побеждает
+        self.assertEqual(tickets["house"].tolist(), ["3", "2"])
+
+    def test_drops_rows_without_guid(self):
+        path = self.write_csv(
+            "GUID клиента,Описание\n"
+            " ,без GUID\n"
+            "a,есть GUID\n"
+            ",тоже без GUID\n"
+        )
+        tickets = tickets_frame(read_csv_fast(path, raw_text=True))
+        self.assertEqual(tickets["guid"].tolist(), ["a"])
+        self.assertEqual(tickets["description"].tolist(), ["есть GUID"])
+
+    def test_city_falls_back_to_spelling_without_yo(self):
+        path = self.write_csv(
+            "GUID клиента,Населённый пункт,Населенный пункт\n"
+            "a,Алматы,Астана\n"      # «Населённый пункт» приоритетнее
+            "b,,Астана\n"            # пусто — берём «Населенный пункт»
+            "c,,\n"                  # пусто в обеих
+        )
+        tickets = tickets_frame(read_csv_fast(path, raw_text=True))
+        self.assertEqual(tickets["city"].tolist(), ["Алматы", "Астана", ""])
+
+
+class OfficeResolverTests(SimpleTestCase):
+    def test_matches_like_icontains_first(self):
+        resolve = build_office_resolver([("Алматы", 1), (" астана ", 2), ("Астана-2", 3)])
+        self.assertEqual(resolve("АСТАНА"), 2)   # нормализованное имя, а не первая подстрока
+        self.assertEqual(resolve("лмат"), 1)     # подстрока без учёта регистра
+        self.assertIsNone(resolve("Шымкент"))
+
+
+class FindManagerTests(SimpleTestCase):
+    def test_exact_name_wins_over_lower_pk_substring(self):
+        # Намеренное отличие от icontains().first(): тот вернул бы pk 1 («Иван Петрович»)
+        index, folded = build_manager_index([
+            Manager(pk=1, full_name="Иван Петрович"),
+            Manager(pk=2, full_name="Иван Петров"),
+        ])
+        self.assertEqual(find_manager("иван петров", index, folded).pk, 2)
+        self.assertEqual(find_manager("Петрович", index, folded).pk, 1)
+        self.assertIsNone(find_manager("Сидоров", index, folded))
+
+
+class UpdateManagerLoadsTests(TestCase):
+    def test_load_matches_distinct_fk_or_name_count(self):
+        office = BusinessUnit.objects.create(name="Алматы", address="")
+        anna = Manager.objects.create(full_name="Анна", office=office, current_load=5)
+        boris = Manager.objects.create(full_name="Борис", office=office, current_load=0)
+        results = [
+            (anna, ""),         # только по FK
+            (None, "Анна"),     # только по имени
+            (anna, "Анна"),     # по FK и по имени — считается один раз
+            (anna, "Борис"),    # FK на одного, имя другого — обоим
+            (boris, "Борис"),
+        ]
+        for i, (manager, name) in enumerate(results):
+            ticket = Ticket.objects.create(guid=f"g{i}", description="")
+            RoutingResult.objects.create(ticket=ticket, assigned_manager=manager, manager_name=name)
+
+        expected = {
+            m.pk: m.current_load + RoutingResult.objects.filter(
+                Q(assigned_manager=m) | Q(manager_name=m.full_name)
+            ).distinct().count()
+            for m in Manager.objects.all()
+        }
+        with redirect_stdout(StringIO()):
+            update_manager_loads()
+
+        self.assertEqual(dict(Manager.objects.values_list("pk", "current_load")), expected)
+        self.assertEqual(expected, {anna.pk: 5 + 4, boris.pk: 0 + 2})
@@ -15,22 +15,16 @@ start.py — Быстрый запуск FIRE для проверяющих
 
 import os
 import sys
-import subprocess
 
-# Читаем .env вручную (до django.setup)
-try:
-    from dotenv import load_dotenv
-    load_dotenv()
-except ImportError:
-    pass
+from routing.io_utils import get_db_config
 
-DB_HOST = os.getenv("DB_HOST", "localhost")
-DB_PORT = os.getenv("DB_PORT", "5433")
-DB_USER = os.getenv("DB_USER", "postgres")
-DB_PASS = os.getenv("DB_PASS", "1234")
-DB_NAME = os.getenv("DB_NAME", "fire_db")
+# .env читается один раз — те же параметры видят и этот скрипт, и Django ниже
+DB      = get_db_config()
+DB_HOST = DB["host"]
+DB_PORT = DB["port"]
+DB_NAME = DB["dbname"]
 
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "fire_project.settings")
 
 def step(n, msg):
     print(f"\n{'─'*55}")
@@ -43,11 +37,7 @@ def ensure_database():
     try:
         import psycopg2
         # Подключаемся к системной БД postgres
-        conn = psycopg2.connect(
-            host=DB_HOST, port=DB_PORT,
-            user=DB_USER, password=DB_PASS,
-            dbname="postgres"
-        )
+        conn = psycopg2.connect(**{**DB, "dbname": "postgres"})
         conn.autocommit = True
         cur = conn.cursor()
 
@@ -73,26 +63,28 @@ def ensure_database():
         sys.exit(1)
 
 # ── 2. Миграции ──────────────────────────────────────────────
+# migrate и загрузка — в этом же процессе: без отдельного интерпретатора
+# и повторного импорта Django/pandas на каждый шаг
 def run_migrations():
     step("2/3", "Применение Django-миграций")
-    result = subprocess.run(
-        [sys.executable, "manage.py", "migrate"],
-        cwd=BASE_DIR
-    )
-    if result.returncode != 0:
-        print("  ❌ Миграции завершились с ошибкой")
+    import django
+    from django.core.management import call_command
+    try:
+        django.setup()
+        call_command("migrate")
+    except Exception as e:
+        print(f"  ❌ Миграции завершились с ошибкой: {e}")
         sys.exit(1)
     print("  ✅ Миграции применены")
 
 # ── 3. Загрузка данных ───────────────────────────────────────
 def load_data():
     step("3/3", "Загрузка данных из CSV (офисы → менеджеры → тикеты)")
-    result = subprocess.run(
-        [sys.executable, "load_data.py"],
-        cwd=BASE_DIR
-    )
-    if result.returncode != 0:
-        print("  ❌ Ошибка при загрузке данных")
+    try:
+        from load_data import load_all
+        load_all()
+    except Exception as e:
+        print(f"  ❌ Ошибка при загрузке данных: {e}")
         sys.exit(1)
 
 # ── 4. Streamlit ─────────────────────────────────────────────